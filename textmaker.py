@@ -2,24 +2,36 @@
 
 
 import math
+import bisect
 import json
 import sys
 import os
+import io
+import functools
 
-from copy import deepcopy
-
+from collections import OrderedDict
 from typing import Literal
 
+# pillow-simd can be installed in place of pillow, it speeds up the alpha_composite and resize calls
+# that make up most of the image work here and needs no code changes
 from PIL import Image
 from PIL import ImageFont
 from PIL import ImageDraw
 
+# optional, parses json faster than the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from pathlib import Path
 
 resource_path = Path("resources")
 outdir = Path("out")
-parse_queue = []
 ngenerated = 0
+generated_parts = []
+# merged style data for every combination of matching predicates, per style
+merge_cache = {}
 
 
 class Font:
@@ -33,9 +45,8 @@ class Font:
         match path.suffix:
             case ".ttf" | ".otf":
                 self.type = "ttf"
-                fontf = path.open("rb")
-                self.resolved = ImageFont.truetype(fontf, size)
-                fontf.close()
+                # the same font file is often loaded at several sizes, so its contents are only read once
+                self.resolved = ImageFont.truetype(io.BytesIO(load_bytes(path)), size)
             case ".pil":
                 self.type = "pil"
                 self.resolved = ImageFont.load(path)
@@ -45,50 +56,83 @@ class Font:
             case "_":
                 raise ValueError("Not a supported font type!")
 
+        # reused for measuring text when no canvas is given, the size of the canvas does not affect the bbox
+        self._dummy_canvas = ImageDraw.Draw(blank_rgba((1, 1)))
+        # per-character advance widths
+        self._advance_cache: dict[str, float] = {}
+        # results of wraptext and of textsize on the dummy canvas, the same text comes up again across queue entries
+        self._wrap_cache: OrderedDict[tuple, tuple[str, int]] = OrderedDict()
+        self._size_cache: OrderedDict[tuple, tuple[int, int]] = OrderedDict()
+
     def wraptext(self, text: str, maxwidth: int, canvas=None, break_on_any: bool = False) -> (str, int):
-        textcut = text[:]
-        textout = ""
+        # the canvas only provides measurements, which do not depend on it
+        return lru_lookup(self._wrap_cache, 256, (text, maxwidth, break_on_any),
+                          lambda text, maxwidth, break_on_any: self._wraptext(text, maxwidth, canvas, break_on_any))
 
-        while len(textcut) > 0:
-            textwidth = self.textsize(textcut, canvas)[0]
-            if textwidth < maxwidth:
-                textout += textcut
+    def _wraptext(self, text: str, maxwidth: int, canvas=None, break_on_any: bool = False) -> (str, int):
+        textout = ""
+        # wrapping only ever adds newlines, so count the ones already present up front and then each break
+        nlines = text.count("\n") + 1
+
+        # confirming the wrap point measures overlapping prefixes of the same text, so remember them for this call
+        # they are measured on a canvas directly so that they do not also fill the per-font size cache
+        if canvas is None:
+            canvas = self._dummy_canvas
+
+        @functools.lru_cache(maxsize=256)
+        def textwidth_cached(subtext: str) -> int:
+            return self.textsize(subtext, canvas)[0]
+
+        # summed glyph advances of every prefix of text, used to locate the wrap point without asking pillow
+        widths = [0]
+        acc = 0
+        for char in text:
+            acc += self._advance(char)
+            widths.append(acc)
+        # glyphs can overhang their advance a little, but never by a whole em, so text this short fits as it is
+        if widths[-1] + self.size < maxwidth:
+            return text, nlines
+        # start of the line currently being wrapped
+        start = 0
+
+        while start < len(text):
+            # end of the longest substring whose advances fit in the designated width
+            end = bisect.bisect_right(widths, widths[start] + maxwidth, start) - 1
+            # kerning and glyph overhang can make the real width differ slightly, so confirm against the bbox
+            while end > start + 1 and textwidth_cached(text[start:end]) > maxwidth:
+                end -= 1
+            while end < len(text) and textwidth_cached(text[start:end + 1]) <= maxwidth:
+                end += 1
+            # the rest of the text is only measured as a whole once it could actually fit
+            if end == len(text) and textwidth_cached(text[start:]) < maxwidth:
+                textout += text[start:]
                 break
-
-            # binary search for the longest substring that can fit in the designated width
-            startpos = 0
-            endpos = len(textcut)
-            last_below = 0
-            for i in range(0, math.floor(math.log2(len(textcut)) + 1)):
-                curpos = (len(textcut[startpos:endpos]) // 2) + startpos
-                textwidth = self.textsize(textcut[:curpos], canvas)[0]
-
-                if textwidth < maxwidth:
-                    startpos = curpos + 1
-                    last_below = curpos
-                elif textwidth > maxwidth:
-                    endpos = curpos - 1
-                else:
-                    last_below = curpos
-                    break
+            cut = max(min(end, len(text) - 1), start + 1)
 
             # break at the nearest space instead of the found position, if possible
-            breakpos = textcut.rfind(" ", 0, last_below + 1)
+            breakpos = text.rfind(" ", start, cut + 1)
             if breakpos == -1 or break_on_any:
-                textout += textcut[:last_below] + "\n"
-                textcut = textcut[last_below:]
+                textout += text[start:cut] + "\n"
+                nlines += 1
+                start = cut
             else:
-                textout += textcut[:breakpos] + "\n"
-                textcut = textcut[breakpos + 1:]
+                textout += text[start:breakpos] + "\n"
+                nlines += 1
+                start = breakpos + 1
+
+        return textout, nlines
 
-        return textout, textout.count("\n") + 1
+    def _advance(self, char: str) -> float:
+        if char not in self._advance_cache:
+            self._advance_cache[char] = self.resolved.getlength(char, self.fontmode)
+        return self._advance_cache[char]
 
     def textsize(self, text: str, canvas=None) -> tuple[int, int]:
         match self.type:
             case "ttf" | "pil":
                 if canvas is None:
-                    # dummy canvas
-                    canvas = ImageDraw.Draw(Image.new("RGBA", (1000, 1000), (0, 0, 0, 0)))
+                    return lru_lookup(self._size_cache, 512, (text,),
+                                      lambda text: self.textsize(text, self._dummy_canvas))
                 canvas.fontmode = self.fontmode
                 bbox = canvas.multiline_textbbox((0, 0), text, self.resolved)
                 return bbox[2] - bbox[0], bbox[3] - bbox[1]
@@ -120,17 +164,67 @@ class Font:
                 pass
 
 
+# resources do not change while running, so everything loaded from disk is cached
+# the results are shared between callers and must not be mutated
+@functools.lru_cache(maxsize=None)
 def load_json(path: Path):
-    jfile = path.open()
-    result = json.load(jfile)
-    jfile.close()
-    return result
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    with path.open() as jfile:
+        return json.load(jfile)
+
+
+@functools.lru_cache(maxsize=None)
+def load_bytes(path: Path) -> bytes:
+    return path.read_bytes()
+
+
+@functools.lru_cache(maxsize=None)
+def open_image(path: Path) -> Image.Image:
+    # everything gets composited in RGBA, so convert once here instead of for every generated image
+    with Image.open(path) as image:
+        return image.convert("RGBA")
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(path: Path, size: int, antialias: bool) -> Font:
+    return Font(path, size, antialias)
+
+
+# looks up key in an OrderedDict used as a bounded cache, on a miss func(*key) is stored
+# and the least recently used entry is evicted once there are more than maxsize
+def lru_lookup(cache: OrderedDict, maxsize: int, key: tuple, func):
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = cache[key] = func(*key)
+    if len(cache) > maxsize:
+        cache.popitem(last=False)
+    return value
+
+
+def blank_rgba(size) -> Image.Image:
+    # without a color pillow allocates zeroed memory instead of filling every pixel, so this is fully transparent
+    return Image.new("RGBA", tuple(size), None)
+
+
+# composites onto base in place
+def composite_alpha(base: Image.Image, overlay: Image.Image, offset: tuple = (0, 0)):
+    if overlay.mode != "RGBA":
+        overlay = overlay.convert("RGBA")
+    # only the part of the overlay that lies on the base is composited
+    ox, oy = offset
+    left, top = max(-ox, 0), max(-oy, 0)
+    right, bottom = min(overlay.width, base.width - ox), min(overlay.height, base.height - oy)
+    if left >= right or top >= bottom:
+        return
+    base.alpha_composite(overlay, (max(ox, 0), max(oy, 0)), (left, top, right, bottom))
 
 
 def paste_alpha(base: Image.Image, overlay: Image.Image, offset: tuple = (0, 0)) -> Image.Image:
-    padded_overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
-    padded_overlay.paste(overlay, offset)
-    return Image.alpha_composite(base, padded_overlay)
+    result = base.copy()
+    composite_alpha(result, overlay, offset)
+    return result
 
 
 # PIL.Image.Resampling exists but pycharm does not believe that
@@ -153,35 +247,24 @@ def get_filter(imgfilter: str, default: int = Image.Resampling.NEAREST):
             return default
 
 
-def find_nth(haystack, needle, n):
-    start = haystack.find(needle)
-    while start >= 0 and n > 1:
-        start = haystack.find(needle, start+len(needle))
-        n -= 1
-    return start
-
-
+# leaves are shared with a and b rather than copied, so the result must not be mutated
 def merge_dicts(a: dict, b: dict) -> dict:
-    result = {}
+    result = dict(a)
 
-    for key in a:
-        if key in b:
-            if isinstance(a[key], dict) and isinstance(b[key], dict):
-                result[key] = merge_dicts(a[key], b[key])
-            else:
-                result[key] = deepcopy(b[key])
+    for key, val in b.items():
+        if isinstance(val, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_dicts(result[key], val)
         else:
-            result[key] = deepcopy(a[key])
-
-    for key in b:
-        if key not in a:
-            result[key] = deepcopy(b[key])
+            result[key] = val
 
     return result
 
 
+# repeated textboxes are drawn on identical frames, so recently expanded images are reused
+# the result is shared and must not be mutated
+@functools.lru_cache(maxsize=32)
 def create_expand(base_imagepath: Path, size: (int, int), divides: (int, int, int, int)) -> Image.Image:
-    base_image = Image.open(base_imagepath)
+    base_image = open_image(base_imagepath)
     # target width and height
     w, h = size
     # division lines on base image
@@ -232,78 +315,98 @@ def create_expand(base_imagepath: Path, size: (int, int), divides: (int, int, in
         "br": (rsw, bsh)
     }
 
-    output = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    output = blank_rgba((w, h))
     for section in section_locations:
-        output.paste(base_image.resize(section_sizes[section], Image.Resampling.NEAREST, section_bounds[section]),
-                     section_locations[section])
+        x1, y1, x2, y2 = section_bounds[section]
+        if section_sizes[section] == (x2 - x1, y2 - y1):
+            # corners, and edges along an axis that is not stretched, are copied as they are
+            part = base_image.crop(section_bounds[section])
+        else:
+            part = base_image.resize(section_sizes[section], Image.Resampling.NEAREST, section_bounds[section])
+        output.paste(part, section_locations[section])
 
     return output
 
 
-def get_styles() -> list[str]:
-    return load_json(resource_path / "styles.json")
+@functools.lru_cache(maxsize=None)
+def get_styles() -> frozenset[str]:
+    return frozenset(load_json(resource_path / "styles.json"))
+
+
+# predicates come from style files and are evaluated for every generated image, so only split them up once
+@functools.lru_cache(maxsize=None)
+def compile_predicate(predicate: str) -> tuple:
+    result = []
+
+    for ppart_or in predicate.split("|"):
+        pparts = []
+        for ppart in ppart_or.split("&"):
+            ptype, _, pval = ppart.partition(":")
+            if ptype == "lines":
+                # lines:<textbox>><count>
+                tname, _, val = pval.partition(">")
+                pval = (tname, int(val))
+            pparts.append((ptype, pval))
+        result.append(tuple(pparts))
+
+    return tuple(result)
 
 
 def eval_predicate(predicate: str, predicate_data: dict) -> bool:
     if predicate == "default":
         return True
 
-    for ppart_or in predicate.split("|"):
+    for ppart_or in compile_predicate(predicate):
         presult = True
-        for ppart in ppart_or.split("&"):
-            ptype, _, pval = ppart.partition(":")
+        for ptype, pval in ppart_or:
             match ptype:
                 case "exists" | "flag":
                     if ptype not in predicate_data or pval not in predicate_data[ptype]:
                         presult = False
                 case "lines":
-                    if ptype in predicate_data:
-                        tname, _, val = pval.partition(">")
-                        if tname not in predicate_data[ptype] or not predicate_data[ptype][tname] > val:
-                            presult = False
-                    else:
+                    tname, val = pval
+                    if ptype not in predicate_data or tname not in predicate_data[ptype] or \
+                            not predicate_data[ptype][tname] > val:
                         presult = False
+            if not presult:
+                break
         if presult:
             return True
     return False
 
 
 def merge_data(style_data: dict, predicate_data: dict) -> dict:
-    result = {}
-
-    for predicate in style_data["predicates"].keys():
-        if eval_predicate(predicate, predicate_data):
+    matched = tuple(
+        predicate for predicate in style_data["predicates"] if eval_predicate(predicate, predicate_data)
+    )
+
+    # style_data is kept alongside its merges so its id cannot be reused by another dict
+    _, merged = merge_cache.setdefault(id(style_data), (style_data, {}))
+    if matched not in merged:
+        result = {}
+        for predicate in matched:
             result = merge_dicts(result, style_data["predicates"][predicate])
+        merged[matched] = result
 
-    return result
-
+    return merged[matched]
 
-def parse_input(rinput):
-    global parse_queue, ngenerated
-
-    iargs = rinput[:] if isinstance(rinput, list) else rinput.split(" ")
-    parse_queue = [iargs]
-    ngenerated = 0
 
-    if (outdir / "textbox.png").exists():
-        os.remove(outdir / "textbox.png")
-    for image in (outdir / "parts").glob("textbox*.png"):
-        os.remove(image)
+def iter_parses(iargs: list[str]):
+    # the style is loaded once, then every chunk of the input separated by !REPEAT! is parsed against it
+    args = iargs
+    style = args[0]
+    # index of the next argument to parse
+    pos = 1
+    if style not in get_styles():
+        raise ValueError(style + " is not a recognized style!")
+    style_path = resource_path / style
+    style_data = load_json(style_path / "style.json")
+    key_mappings = load_json(style_path / "map.json")
 
-    while len(parse_queue) > 0:
-
-        # parse input
-        args = parse_queue[0][:]
-        style = args[0]
-        del args[0]
-        if style not in get_styles():
-            raise ValueError(style + " is not a recognized style!")
-        style_path = resource_path / style
-        style_data = load_json(style_path / "style.json")
-        key_mappings = load_json(style_path / "map.json")
+    while True:
         predicate_data = {
-            "flag": [],
-            "exists": []
+            "flag": set(),
+            "exists": set()
             # "lines" will be added later
         }
         keys = {}
@@ -318,38 +421,55 @@ def parse_input(rinput):
             else:
                 keys[name] = val
 
-        while args[0].startswith("f:"):
-            predicate_data["flag"].append(args[0][2:])
-            del args[0]
+        flags_end = pos
+        while args[flags_end].startswith("f:"):
+            flags_end += 1
+        predicate_data["flag"].update(arg[2:] for arg in args[pos:flags_end])
+        pos = flags_end
 
         for syntaxpart in style_data["syntax"].split():
             stype, _, sval = syntaxpart.partition(":")
             match stype:
                 case "key":
-                    if args[0] != "!NONE!":
-                        predicate_data["exists"].append("key:" + sval)
-                        parse_key(sval, args[0])
-                    del args[0]
+                    if args[pos] != "!NONE!":
+                        predicate_data["exists"].add("key:" + sval)
+                        parse_key(sval, args[pos])
+                    pos += 1
                 case "text":
-                    if args[0] != "!NONE!":
-                        predicate_data["exists"].append("text:" + sval)
-                        text[sval] = args[0]
-                    del args[0]
+                    if args[pos] != "!NONE!":
+                        predicate_data["exists"].add("text:" + sval)
+                        text[sval] = args[pos]
+                    pos += 1
                 case "rtext":
-                    if "!REPEAT!" not in args:
-                        predicate_data["exists"].append("text:" + sval)
-                        text[sval] = " ".join(args)
-                        args = []
-                    else:
-                        repeat_at = args.index("!REPEAT!")
-                        predicate_data["exists"].append("text:" + sval)
-                        text[sval] = " ".join(args[:repeat_at])
-                        args = args[repeat_at + 1:]
+                    # takes everything up to the next !REPEAT!, or the rest of the input
+                    try:
+                        repeat_at = args.index("!REPEAT!", pos)
+                    except ValueError:
+                        repeat_at = len(args)
+                    predicate_data["exists"].add("text:" + sval)
+                    text[sval] = " ".join(args[pos:repeat_at])
+                    pos = repeat_at + 1
+
+        yield style_path, style_data, predicate_data, keys, text
+
+        # keep parsing if there are leftovers
+        if pos >= len(args):
+            break
+
+
+def parse_input(rinput, keep_parts: bool = False):
+    global ngenerated, generated_parts
+
+    iargs = rinput[:] if isinstance(rinput, list) else rinput.split(" ")
+    ngenerated = 0
+    generated_parts = []
+
+    if (outdir / "textbox.png").exists():
+        os.remove(outdir / "textbox.png")
+    for image in (outdir / "parts").glob("textbox*.png"):
+        os.remove(image)
 
-        # repeat parsing later if there are leftovers
-        if len(args) > 0:
-            args.insert(0, style)
-            parse_queue.append(args)
+    for style_path, style_data, predicate_data, keys, text in iter_parses(iargs):
 
         # key-based overrides
         # TODO decide on syntax in data files for this
@@ -358,10 +478,8 @@ def parse_input(rinput):
         data = merge_data(style_data, predicate_data)
         fonts = {}
 
-        for font in data["fonts"].keys():
-            fonts[font] = Font(style_path / data["fonts"][font]["path"],
-                               data["fonts"][font]["size"],
-                               data["fonts"][font]["aa"])
+        for font, fontdata in data["fonts"].items():
+            fonts[font] = get_font(style_path / fontdata["path"], fontdata["size"], fontdata["aa"])
 
         # preload textbox data
         textboxes = {}
@@ -369,50 +487,39 @@ def parse_input(rinput):
         torepeat = {}
         predicate_data["lines"] = {}
 
-        for textbox in data["textboxes"].keys():
-            textboxes[textbox] = {}
-            tbfont = fonts[data["textboxes"][textbox]["font"]]
-            textboxes[textbox]["font"] = tbfont
+        for textbox, tb in data["textboxes"].items():
+            tb_out = textboxes[textbox] = {}
+            tbfont = fonts[tb["font"]]
+            tb_out["font"] = tbfont
 
-            tbsize = data["textboxes"][textbox]["size"]
-            wrapped_text, nlines = tbfont.wraptext(text[data["textboxes"][textbox]["text"]], tbsize[0])
+            tbsize = tb["size"]
+            wrapped_text, nlines = tbfont.wraptext(text[tb["text"]], tbsize[0])
             if nlines > tbsize[1]:
-                if "overflow" in data["textboxes"][textbox] and data["textboxes"][textbox]["overflow"] == "repeat":
+                lines = wrapped_text.split("\n")
+                if tb.get("overflow") == "repeat":
                     # i literally just wrote this code and it needs a whole ass rework already
                     if repeater is not None:
                         raise ValueError("duplicate repeating textboxes: " + repeater + ", " + textbox)
                     repeater = textbox
-                    torepeat["text"] = []
-                    torepeat["size"] = []
-                    start = 0
-
-                    while start >= 0:
-                        end = find_nth(wrapped_text, "\n", tbsize[1] * (len(torepeat["text"]) + 1))
-                        if end < 0:
-                            break
-                        torepeat["text"].append(wrapped_text[start:end])
-                        torepeat["size"].append(tbfont.textsize(wrapped_text[start:end]))
-                        start = find_nth(wrapped_text, "\n", tbsize[1] * (len(torepeat["text"]))) + 1
-                    torepeat["text"].append(wrapped_text[start:])
-                    torepeat["size"].append(tbfont.textsize(wrapped_text[start:]))
-
-                    textboxes[textbox]["text"] = torepeat["text"][0]
-                    textboxes[textbox]["size"] = torepeat["size"][0]
+                    torepeat["text"] = ["\n".join(lines[i:i + tbsize[1]]) for i in range(0, len(lines), tbsize[1])]
+                    torepeat["size"] = [tbfont.textsize(chunk) for chunk in torepeat["text"]]
+
+                    tb_out["text"] = torepeat["text"][0]
+                    tb_out["size"] = torepeat["size"][0]
                     del torepeat["text"][0]
                     del torepeat["size"][0]
 
                 else:
-                    bpoint = find_nth(wrapped_text, "\n", tbsize[1])
-                    textboxes[textbox]["text"] = wrapped_text[:bpoint]
-                    textboxes[textbox]["size"] = tbfont.textsize(wrapped_text[:bpoint])
+                    tb_out["text"] = "\n".join(lines[:tbsize[1]])
+                    tb_out["size"] = tbfont.textsize(tb_out["text"])
                 predicate_data["lines"][textbox] = tbsize[1]
 
             else:
-                textboxes[textbox]["text"] = wrapped_text
-                textboxes[textbox]["size"] = tbfont.textsize(wrapped_text)
+                tb_out["text"] = wrapped_text
+                tb_out["size"] = tbfont.textsize(wrapped_text)
                 predicate_data["lines"][textbox] = nlines
 
-            textboxes[textbox]["pos"] = data["textboxes"][textbox]["pos"]
+            tb_out["pos"] = tb["pos"]
 
         while repeater is None or len(torepeat["text"]) > 0:
             data = merge_data(style_data, predicate_data)
@@ -420,59 +527,58 @@ def parse_input(rinput):
             # resolve images
             images = {}
 
-            for image in data["images"].keys():
-                if not isinstance(data["images"][image], dict):
+            for image, img in data["images"].items():
+                if not isinstance(img, dict):
                     continue
-                if "key" in data["images"][image]:
-                    imagepath = style_path / keys[data["images"][image]["key"]]
+                if "key" in img:
+                    imagepath = style_path / keys[img["key"]]
                 else:
-                    imagepath = style_path / data["images"][image]["path"]
-                if "divide" in data["images"][image]:
-                    if "textbox" in data["images"][image]:
-                        imagesize = data["images"][image]["size"]
-                        if "x" in data["images"][image]["bind_axes"]:
-                            imagesize[0] = textboxes[data["images"][image]["textbox"]]["size"][0] + \
-                                           data["images"][image]["sizemod"][0]
-                        if "y" in data["images"][image]["bind_axes"]:
-                            imagesize[1] = textboxes[data["images"][image]["textbox"]]["size"][1] + \
-                                           data["images"][image]["sizemod"][1]
-                        images[image] = create_expand(imagepath, imagesize, data["images"][image]["divide"])
+                    imagepath = style_path / img["path"]
+                if "divide" in img:
+                    if "textbox" in img:
+                        imagesize = list(img["size"])
+                        boundsize = textboxes[img["textbox"]]["size"]
+                        if "x" in img["bind_axes"]:
+                            imagesize[0] = boundsize[0] + img["sizemod"][0]
+                        if "y" in img["bind_axes"]:
+                            imagesize[1] = boundsize[1] + img["sizemod"][1]
+                        images[image] = create_expand(imagepath, tuple(imagesize), tuple(img["divide"]))
                     else:
-                        images[image] = create_expand(
-                            imagepath, data["images"][image]["size"], data["images"][image]["divide"]
-                        )
+                        images[image] = create_expand(imagepath, tuple(img["size"]), tuple(img["divide"]))
                 else:
-                    images[image] = Image.open(imagepath)
+                    images[image] = open_image(imagepath)
                     # TODO scale images
 
             # paste everything together
             composite = None
             if "basesize" in data["images"]:
-                composite = Image.new("RGBA", data["images"]["basesize"], (0, 0, 0, 0))
+                composite = blank_rgba(data["images"]["basesize"])
             for image in images:
                 if composite is None:
-                    composite = images[image].copy()
+                    # convert makes a copy as well, and keeps every generated part in the same mode for stitching
+                    composite = images[image].convert("RGBA")
                     continue
-                composite = paste_alpha(composite, images[image], data["images"][image]["pos"])
+                # composite is a fresh image owned by this loop, so layers can go straight onto it
+                composite_alpha(composite, images[image], data["images"][image]["pos"])
 
             canvas = ImageDraw.Draw(composite)
-            for textbox in textboxes:
-                text = textboxes[textbox]["text"]
-
-                fill = tuple(data["textboxes"][textbox]["color"]) if "color" in data["textboxes"][textbox] else None
-                anchor = data["textboxes"][textbox]["anchor"] if "anchor" in data["textboxes"][textbox] else None
-                spacing = data["textboxes"][textbox]["spacing"] if "spacing" in data["textboxes"][textbox] else 4
-                align = data["textboxes"][textbox]["align"] if "align" in data["textboxes"][textbox] else "left"
-
-                textboxes[textbox]["font"].rendertext(canvas,
-                                                      data["textboxes"][textbox]["pos"],
-                                                      text,
-                                                      fill,
-                                                      anchor,
-                                                      spacing,
-                                                      align)
-
-            composite.save(outdir / "parts" / ("textbox" + str(ngenerated) + ".png"))
+            for textbox, tb_out in textboxes.items():
+                tb = data["textboxes"][textbox]
+                fill = tuple(tb["color"]) if "color" in tb else None
+
+                tb_out["font"].rendertext(canvas,
+                                          tb["pos"],
+                                          tb_out["text"],
+                                          fill,
+                                          tb.get("anchor"),
+                                          tb.get("spacing", 4),
+                                          tb.get("align", "left"))
+
+            generated_parts.append(composite)
+            if keep_parts:
+                # parts are only kept for inspection, so favor encoding speed over file size
+                composite.save(outdir / "parts" / ("textbox" + str(ngenerated) + ".png"),
+                               optimize=False, compress_level=1)
             ngenerated += 1
 
             if repeater is None:
@@ -488,27 +594,27 @@ def parse_input(rinput):
             if len(torepeat["text"]) <= 0:
                 repeater = None
 
-        del parse_queue[0]
-
     # paste all generated images together
-    genimgs = list((outdir / "parts").glob("textbox*.png"))
-    genimgs.sort(key=lambda fname: int(fname.name.strip("textbox").rstrip(".png")))
+    if len(generated_parts) == 1:
+        generated_parts[0].save(outdir / "textbox.png")
+        return
     totalh = 0
     maxw = 0
-    images = []
-    for image in genimgs:
-        imgd = Image.open(image)
-        totalh += imgd.height
-        if maxw < imgd.width:
-            maxw = imgd.width
-        images.append(imgd)
-    composite = Image.new("RGBA", (maxw, totalh), (0, 0, 0, 0))
+    for image in generated_parts:
+        totalh += image.height
+        if maxw < image.width:
+            maxw = image.width
+    composite = blank_rgba((maxw, totalh))
     currenth = 0
-    for image in images:
+    for image in generated_parts:
         composite.paste(image, (0, currenth))
         currenth += image.height
     composite.save(outdir / "textbox.png")
 
 
 if __name__ == "__main__":
-    parse_input(sys.argv[1:])
+    # --keep-parts before the style also writes every generated textbox to out/parts
+    if len(sys.argv) > 1 and sys.argv[1] == "--keep-parts":
+        parse_input(sys.argv[2:], True)
+    else:
+        parse_input(sys.argv[1:])